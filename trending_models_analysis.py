@@ -1,11 +1,21 @@
-from huggingface_hub import HfApi, get_repo_discussions
+from huggingface_hub import HfApi, get_repo_discussions, model_info
+from huggingface_hub.utils import HfHubHTTPError
 from datasets import Dataset, concatenate_datasets, load_dataset, DatasetDict
-from datetime import datetime
-import pandas as pd
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+import random
+import shelve
+import threading
 import sys
 import os
 import logging
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+from utils import login_check
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -15,9 +25,8 @@ logger = logging.getLogger(__name__)
 SLACK_WEBHOOK_URL = os.environ.get("SLACK_WEBHOOK_URL")
 
 # Constants
-COLLECTION_DATE = datetime.utcnow().isoformat()
 EXCLUDED_ORGS = ['meta-llama', 'mistralai']
-ALLOWED_LICENSES = [
+ALLOWED_LICENSES = frozenset([
     "apache-2.0",
     "mit",
     "creativeml-openrail-m",
@@ -74,8 +83,8 @@ ALLOWED_LICENSES = [
     "epl-1.0",
     "cc-by-nc-nd-3.0",
     "eupl-1.1",
-]
-SUPPORTED_TASKS = [
+])
+SUPPORTED_TASKS = frozenset([
     "feature-extraction",
     "automatic-speech-recognition",
     "text-to-speech",
@@ -100,8 +109,116 @@ SUPPORTED_TASKS = [
     'sentence-similarity',
     'summarization',
     'image-text-to-text'
-]
+])
 SUPPORTED_LIBRARIES = ['diffusers', 'transformers', 'sentence-transformers']
+MAX_WORKERS = 32
+MAX_HUB_CONCURRENCY = 20
+MAX_RETRIES = 8
+REQUEST_TIMEOUT = (3.05, 10)  # (connect, read) seconds
+CACHE_PATH = os.path.expanduser("~/.cache/azure-cron/http_cache")
+CATALOG_CACHE_TTL = 24 * 3600  # 1 day
+SECURITY_CACHE_TTL = 7 * 24 * 3600  # 7 days
+HISTORY_DAYS = 90  # collection runs kept in the published dataset
+
+# Shared HTTP session so connections are pooled across calls
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=MAX_WORKERS,
+    pool_maxsize=MAX_WORKERS,
+    max_retries=Retry(
+        total=MAX_RETRIES,
+        # Retry a stalled socket only once so REQUEST_TIMEOUT bounds the call
+        connect=1,
+        read=1,
+        backoff_factor=1.0,
+        backoff_jitter=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        respect_retry_after_header=True,
+        raise_on_status=False  # hand the last response back to the caller
+    )
+))
+# Slack may already have posted a message that errored or timed out, so only
+# rate limits are retried there, never 5xx or read timeouts
+SESSION.mount("https://hooks.slack.com/", HTTPAdapter(
+    max_retries=Retry(
+        total=MAX_RETRIES,
+        connect=0,
+        read=0,
+        other=0,
+        status_forcelist=[429],
+        allowed_methods=["POST"],
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+))
+
+# In-memory copy of the on-disk lookup cache, loaded by main(). Worker threads
+# only touch this dict: dbm handles (e.g. dbm.sqlite3) can't be shared across
+# threads.
+CACHE = None
+CACHE_LOCK = threading.Lock()
+
+# Caps in-flight Hub discussion requests independently of the worker pool
+HUB_SEMAPHORE = threading.BoundedSemaphore(MAX_HUB_CONCURRENCY)
+
+def open_cache(refresh=False):
+    """Load the on-disk lookup cache, or start empty to refresh every entry."""
+    global CACHE
+    os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+    with CACHE_LOCK:
+        if refresh:
+            # Fresh results still overwrite the stored entries on close
+            CACHE = {}
+            return
+        with shelve.open(CACHE_PATH) as shelf:
+            CACHE = dict(shelf)
+
+def close_cache():
+    """Write the in-memory lookup cache back to disk."""
+    global CACHE
+    with CACHE_LOCK:
+        if CACHE is None:
+            return
+        with shelve.open(CACHE_PATH) as shelf:
+            shelf.update(CACHE)
+        CACHE = None
+
+def cache_get(key, ttl):
+    """Return (hit, value) for a cached entry younger than ttl seconds."""
+    if CACHE is None:
+        return False, None
+    with CACHE_LOCK:
+        entry = CACHE.get(key)
+    if entry is None or time.time() - entry[0] > ttl:
+        return False, None
+    return True, entry[1]
+
+def cache_set(key, value):
+    """Store a value in the on-disk cache."""
+    if CACHE is None:
+        return
+    with CACHE_LOCK:
+        CACHE[key] = (time.time(), value)
+
+def retry_on_rate_limit(func):
+    """Retry a Hub call with exponential backoff while it is rate limited (429)."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(MAX_RETRIES):
+            try:
+                return func(*args, **kwargs)
+            except HfHubHTTPError as e:
+                status_code = getattr(e.response, 'status_code', None)
+                if status_code != 429 or attempt == MAX_RETRIES - 1:
+                    raise
+                delay = min(30 * 1.5 ** attempt, 600) * random.uniform(0.5, 1.5)
+                logger.warning(f"Rate limited by the Hub, retrying in {delay:.0f}s")
+                time.sleep(delay)
+    return wrapper
+
+def utc_now():
+    """Current UTC time without tzinfo, matching existing collected_at values."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
 
 def get_trending_models_and_datasets():
     """Fetch top 200 trending models from Hugging Face Hub."""
@@ -112,7 +229,17 @@ def get_trending_models_and_datasets():
         sort="trendingScore",
         direction=-1,
         limit=200,
-        full=True
+        # `expand` cannot be combined with `full`, so list every field we read
+        expand=[
+            "sha",
+            "tags",
+            "library_name",
+            "gated",
+            "pipeline_tag",
+            "createdAt",
+            "lastModified",
+            "safetensors",
+        ]
     )
     return models
 
@@ -123,138 +250,188 @@ def send_slack_message(payload: dict):
         return
 
     try:
-        response = requests.post(SLACK_WEBHOOK_URL, json=payload)
+        response = SESSION.post(SLACK_WEBHOOK_URL, json=payload, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
         logger.info(f"Slack payload sent successfully: {payload}")
     except requests.exceptions.RequestException as e:
         logger.error(f"Failed to send Slack message: {e}")
 
-def is_safetensors_bot_pr(model_id):
-    """Find the latest open PR by SFconvertbot for the given model"""
-    try:
-        discussions = list(get_repo_discussions(
+@retry_on_rate_limit
+def get_safetensors_bot_pr(model_id):
+    """Return the first open PR by SFconvertbot for the given model, if any"""
+    # Discussions are paginated lazily, so only the first page is fetched
+    with HUB_SEMAPHORE:
+        return next(iter(get_repo_discussions(
             repo_id=model_id,
             author="SFconvertbot",
             discussion_type="pull_request",
             discussion_status="open"
-        ))
-        
-        # Find the most recent PR
-        return bool(discussions)
+        )), None)
+
+def is_safetensors_bot_pr(model_id):
+    """Find the latest open PR by SFconvertbot for the given model"""
+    try:
+        return get_safetensors_bot_pr(model_id) is not None
     except Exception as e:
         logger.error(f"Error fetching PR for {model_id}: {str(e)}")
         return False
 
 def is_model_in_catalog(model_id):
     """Check if the model is in the Azure Model Catalog"""
-    response = requests.get(
-        url="https://generate-azureml-urls.azurewebsites.net/api/generate", 
-        params={"modelId": model_id}
-    )
-    return response.status_code == 200
+    cache_key = f"catalog:{model_id}"
+    hit, in_catalog = cache_get(cache_key, CATALOG_CACHE_TTL)
+    if hit:
+        return in_catalog
 
-def is_security_scanned(model_id):
-    """Check security status for a given model."""
-    url = f"https://huggingface.co/api/models/{model_id}?securityStatus=1&expand[]=sha"
-    
     try:
-        response = requests.get(url)
-        if response.status_code == 200:
-            data = response.json()
-            
-            # Check if securityRepoStatus exists
-            if 'securityRepoStatus' in data:
-                security_status = data['securityRepoStatus']
-                if security_status.get('scansDone', False) is False:
-                    return None
-                is_secure = (
-                    security_status.get('scansDone', False) is True and 
-                    len(security_status.get('filesWithIssues', [])) == 0
-                )
-                return is_secure
-            
-            # Check if nested somewhere else
-            for key, value in data.items():
-                if isinstance(value, dict) and 'securityRepoStatus' in value:
-                    security_status = value['securityRepoStatus']
-                    is_secure = (
-                        security_status.get('scansDone', False) is True and 
-                        len(security_status.get('filesWithIssues', [])) == 0
-                    )
-                    return is_secure
-                    
-        return None  # Security status not found or request failed
+        response = SESSION.get(
+            url="https://generate-azureml-urls.azurewebsites.net/api/generate", 
+            params={"modelId": model_id},
+            timeout=REQUEST_TIMEOUT
+        )
+    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+        logger.error(f"Error checking catalog for {model_id}: {str(e)}")
+        return None
+    # Only 200/404 are definite answers; rate limits or server errors left
+    # after retries are unknown and not cached
+    if response.status_code not in (200, 404):
+        logger.error(f"Error checking catalog for {model_id}: HTTP {response.status_code}")
+        return None
+    in_catalog = response.status_code == 200
+    cache_set(cache_key, in_catalog)
+    return in_catalog
+
+@retry_on_rate_limit
+def get_security_status(model_id):
+    """Fetch the securityRepoStatus of the given model"""
+    # Only available per model: list_models can't expand it
+    with HUB_SEMAPHORE:
+        return model_info(model_id, securityStatus=True).security_repo_status
+
+def is_security_scanned(model_id, sha):
+    """Check security status for a given model revision."""
+    # Keyed by revision, so a new commit is looked up again
+    cache_key = f"sec:{model_id}:{sha}"
+    if sha:
+        hit, is_secure = cache_get(cache_key, SECURITY_CACHE_TTL)
+        if hit:
+            return is_secure
+
+    try:
+        security_status = get_security_status(model_id)
     except Exception as e:
         logger.error(f"Error checking {model_id}: {str(e)}")
         return None
+    if not security_status or security_status.get('scansDone', False) is False:
+        return None  # Security status not found or scan not done yet
+    is_secure = len(security_status.get('filesWithIssues', [])) == 0
+    if sha:
+        cache_set(cache_key, is_secure)
+    return is_secure
+
+def _enrich(rank, model, collected_at):
+    """Collect raw data and prerequisite checks for a single model."""
+    author = model.id.split('/')[0] if '/' in model.id else ""
+    tags = getattr(model, 'tags', []) or []
+    tag_set = frozenset(tags)
+    license = [tag[len("license:"):] for tag in tags if tag.startswith("license:")]
+    logger.info(f"Processing model: {model.id}")
+
+    ## cheap in-memory checks first
+    is_custom_code = 'custom_code' in tag_set
+    is_excluded_org = author in EXCLUDED_ORGS
+    is_supported_license = bool(license) and any(l in ALLOWED_LICENSES for l in license)
+    is_supported_library = model.library_name in SUPPORTED_LIBRARIES
+    is_supported_task = model.pipeline_tag in SUPPORTED_TASKS
+    passes_local_checks = all([
+        not is_custom_code,
+        not is_excluded_org,
+        is_supported_license,
+        is_supported_library,
+        is_supported_task
+    ])
+
+    # The SFconvertbot PR lookup only matters for models that could still be added
+    is_safetensors = 'safetensors' in tag_set
+    if not is_safetensors and passes_local_checks:
+        is_safetensors = is_safetensors_bot_pr(model.id)
+
+    is_in_catalog = is_model_in_catalog(model.id)
+    # Like the PR lookup, the security scan can't change a blocked model's status
+    is_securely_scanned = None
+    if passes_local_checks:
+        is_securely_scanned = is_security_scanned(model.id, model.sha)
+    if is_in_catalog:
+        model_status = 'added'
+    # An unknown catalog lookup (None) may hide an added model, so it can't be 'to add'
+    elif is_in_catalog is not None and passes_local_checks and is_safetensors and is_securely_scanned:
+        model_status = 'to add'
+    else:
+        model_status = 'blocked'
 
-def prepare_model_data(models):
+    return {
+        ## raw data
+        "id": model.id,
+        "trending_rank": rank,
+        "author": author,
+        "tags": tags,
+        'license': license,
+        'library_name': model.library_name,
+        'gated': bool(model.gated),
+        'task': model.pipeline_tag,
+        ## logic to check supported prerequisites
+        'is_in_catalog' : is_in_catalog,
+        'is_custom_code': is_custom_code,
+        'is_excluded_org' : is_excluded_org, 
+        'is_supported_license' : is_supported_license,
+        'is_supported_library' : is_supported_library,
+        'is_safetensors': is_safetensors,
+        'is_supported_task' : is_supported_task,
+        'is_securely_scanned' : is_securely_scanned,
+        "collected_at": collected_at,
+        'model_status': model_status
+    }
+
+def prepare_model_data(models, collected_at):
     """Prepare model data for the dataset."""
-    model_data = []
     logger.info(f"Preparing model data for trending models...")
-    count = 0
-
-    for model in models:
-        author = model.modelId.split('/')[0] if '/' in model.modelId else ""
-        license = [tag[8:] for tag in model.tags if tag.startswith("license:")]
-        logger.info(f"Processing model: {model.modelId}")
-        count += 1
-        model_data.append({
-            ## raw data
-            "id": model.modelId,
-            "trending_rank": count,
-            "author": author,
-            "tags": model.tags if hasattr(model, 'tags') else [],
-            'license': license,
-            'library_name': model.library_name,
-            'gated': bool(model.gated),
-            'task': model.pipeline_tag,
-            ## logic to check supported prerequisites
-            'is_in_catalog' : is_model_in_catalog(model.modelId),
-            'is_custom_code': 'custom_code' in model.tags,
-            'is_excluded_org' : author in EXCLUDED_ORGS, 
-            'is_supported_license' : bool(license) and any(l in ALLOWED_LICENSES for l in license),
-            'is_supported_library' : model.library_name in SUPPORTED_LIBRARIES,
-            'is_safetensors': 'safetensors' in model.tags or is_safetensors_bot_pr(model.modelId),
-            'is_supported_task' : model.pipeline_tag in SUPPORTED_TASKS,
-            'is_securely_scanned' : is_security_scanned(model.modelId),
-            "collected_at": COLLECTION_DATE
-        })
-
-    logger.info(f"Checking model status for trending models...")
-    for model in model_data:
-        if model['is_in_catalog']:
-            model['model_status'] = 'added'
-        elif all([
-            not model['is_custom_code'],
-            not model['is_excluded_org'],
-            model['is_supported_license'],
-            model['is_supported_library'],
-            model['is_safetensors'],
-            model['is_supported_task'],
-            model['is_securely_scanned']
-        ]):
-            model['model_status'] = 'to add'
-        else:
-            model['model_status'] = 'blocked'
-
-    return pd.DataFrame(model_data)
-
-
-def update_dataset(models_df, dataset_repo):
+
+    # Remote checks are IO-bound, so fan them out over a thread pool
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {
+            executor.submit(_enrich, rank, model, collected_at): rank
+            for rank, model in enumerate(models, start=1)
+        }
+        model_data = [None] * len(futures)
+        for done, future in enumerate(as_completed(futures), start=1):
+            model_data[futures[future] - 1] = future.result()
+            logger.info(f"Enriched {done}/{len(futures)} models")
+
+    return model_data
+
+def prune_history(models, cutoff):
+    """Keep only rows collected since cutoff."""
+    keep = [idx for idx, collected_at in enumerate(models['collected_at']) if collected_at >= cutoff]
+    return models.select(keep)
+
+def update_dataset(model_data, dataset_repo):
     """Update or create the dataset with new data."""   
     try:
         # Try to load existing dataset
         existing_ds = load_dataset(dataset_repo)
         
-        # Append new data to existing splits
-        existing_models = Dataset.from_pandas(existing_ds["models"].to_pandas())
+        # Append new data to existing splits, staying in Arrow
+        existing_models = existing_ds["models"]
+        new_rows = Dataset.from_list(model_data, features=existing_models.features)
         
-        new_models = concatenate_datasets([existing_models, Dataset.from_pandas(models_df)])
+        new_models = concatenate_datasets([existing_models, new_rows])
     except Exception as e:
         logger.info(f"Dataset doesn't exist or couldn't be loaded, creating new one: {e}")
-        new_models = Dataset.from_pandas(models_df)
+        new_models = Dataset.from_list(model_data)
     
+    cutoff = (utc_now() - timedelta(days=HISTORY_DAYS)).isoformat()
+    new_models = prune_history(new_models, cutoff)
+
     # Create dataset with splits
     dataset = DatasetDict({
         "models": new_models
@@ -267,41 +444,39 @@ def update_dataset(models_df, dataset_repo):
 
 def main():
     # Configuration
-    if len(sys.argv) < 2:
-        logger.error("Usage: python trending_analysis.py <DATASET_REPO>")
+    args = [arg for arg in sys.argv[1:] if arg != "--no-cache"]
+    if len(args) < 1:
+        logger.error("Usage: python trending_analysis.py <DATASET_REPO> [--no-cache]")
         return
 
-    DATASET_REPO = sys.argv[1]
+    DATASET_REPO = args[0]
+    refresh_cache = "--no-cache" in sys.argv[1:]
 
     # Check Hugging Face Hub login status
-    hf_api_for_login_check = HfApi()
-    try:
-        user_info = hf_api_for_login_check.whoami()
-        logger.info(f"Successfully logged in to Hugging Face Hub as {user_info['name']}.")
-    except Exception:  # Catches HTTPError (e.g., 401) if not logged in, or other network issues.
-        logger.error(
-            "Failed to verify Hugging Face Hub login status. "
-            "Please ensure you are logged in using 'huggingface-cli login'. "
-            "The script needs to push data to the Hub."
-        )
-        logger.error("Exiting due to authentication issue. Please run 'huggingface-cli login'.")
+    if not login_check():
         return # Exit the main function if not logged in.
 
     # Get data
     models = get_trending_models_and_datasets()
     
-    # Prepare DataFrames
-    models_df = prepare_model_data(models)
+    # Prepare rows
+    collected_at = utc_now().isoformat()
+    open_cache(refresh=refresh_cache)
+    try:
+        model_data = prepare_model_data(models, collected_at)
+    finally:
+        close_cache()
     
     # Update dataset
-    update_dataset(models_df, DATASET_REPO)
+    update_dataset(model_data, DATASET_REPO)
 
     # Send Slack message
+    status_counts = Counter(model['model_status'] for model in model_data)
     message = (
         "📈 Trending Models Analysis 📈\n\n"
-        f"To add: {models_df[models_df['model_status'] == 'to add'].shape[0]}\n"
-        f"Blocked: {models_df[models_df['model_status'] == 'blocked'].shape[0]}\n"
-        f"Added: {models_df[models_df['model_status'] == 'added'].shape[0]}\n"
+        f"To add: {status_counts['to add']}\n"
+        f"Blocked: {status_counts['blocked']}\n"
+        f"Added: {status_counts['added']}\n"
         f"View dataset details: https://hf.co/datasets/hf-azure-internal/trending-models-analysis\n"
         f"View dashboard details: https://hf.co/spaces/hf-azure-internal/trending-models-analysis"
     )
@@ -6,24 +6,32 @@ and update the list of watched items of the webhook
 
 import sys
 from datasets import load_dataset
-from huggingface_hub import update_webhook, HfApi, get_webhook
+from huggingface_hub import update_webhook, get_webhook
 import logging
+from utils import login_check
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+WATCHED_COLUMNS = ['type', 'id']
+
 
 def update_webhook_watched_items(dataset_id, webhook_id):
     """
     Update webhook watched items with models from the dataset
     """
 
-    dataset = load_dataset(dataset_id)
-    dataset_train = dataset['train']
+    # Only load the columns used for the watchlist
+    try:
+        dataset_train = load_dataset(dataset_id, split='train', columns=WATCHED_COLUMNS)
+    except ValueError:  # builder doesn't support column projection (non-parquet data)
+        dataset_train = load_dataset(dataset_id, split='train').select_columns(WATCHED_COLUMNS)
     
-    # Create watched items list from dataset rows
-    watched_items = [{"type": row['type'], "name": row['id']} for row in dataset_train]
+    # Create watched items list from the dataset columns
+    types = dataset_train['type']
+    ids = dataset_train['id']
+    watched_items = [{"type": t, "name": i} for t, i in zip(types, ids)]
     logger.info(f"Found {len(watched_items)} unique watched items")
     logger.info(f"Watched items: {watched_items}")
 
@@ -55,17 +63,7 @@ def main():
     logger.info(f"Updating webhook: {webhook_id} with dataset: {dataset_id}")
 
     # Check Hugging Face Hub login status
-    hf_api_for_login_check = HfApi()
-    try:
-        user_info = hf_api_for_login_check.whoami()
-        logger.info(f"Successfully logged in to Hugging Face Hub as {user_info['name']}.")
-    except Exception:  # Catches HTTPError (e.g., 401) if not logged in, or other network issues.
-        logger.error(
-            "Failed to verify Hugging Face Hub login status. "
-            "Please ensure you are logged in using 'huggingface-cli login'. "
-            "The script needs to push data to the Hub."
-        )
-        print("Exiting due to authentication issue. Please run 'huggingface-cli login'.")
+    if not login_check():
         return # Exit the main function if not logged in.
 
     update_webhook_watched_items(dataset_id, webhook_id)
@@ -0,0 +1,83 @@
+"""
+Helpers shared by the cron scripts
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from huggingface_hub import HfApi, get_token
+from huggingface_hub.constants import HF_HOME
+
+logger = logging.getLogger(__name__)
+
+# Successful whoami() results are reused by scripts running back-to-back on
+# the same machine (GitHub Actions jobs each start on a fresh runner)
+WHOAMI_CACHE_PATH = os.path.join(HF_HOME, "azure-cron", "whoami.json")
+WHOAMI_CACHE_TTL = 600  # 10 minutes
+
+
+def _token_hash():
+    """Hash of the current token, so a cached login is never reused for another token"""
+    token = get_token() or ""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _read_cached_login(token_hash):
+    """Return the cached user name if the cache is fresh and matches the token"""
+    try:
+        if time.time() - os.path.getmtime(WHOAMI_CACHE_PATH) > WHOAMI_CACHE_TTL:
+            return None
+        with open(WHOAMI_CACHE_PATH) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cached.get("token_hash") != token_hash:
+        return None
+    return cached.get("name")
+
+
+def _write_cached_login(token_hash, name):
+    """Store a successful login check"""
+    cache_dir = os.path.dirname(WHOAMI_CACHE_PATH)
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        # Write to a private temp file, then atomically move it into place
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"token_hash": token_hash, "name": name}, f)
+            os.replace(tmp_path, WHOAMI_CACHE_PATH)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError as e:
+        logger.warning(f"Could not cache login status: {e}")
+
+
+def login_check():
+    """
+    Check Hugging Face Hub login status, returns True if logged in
+    """
+    token_hash = _token_hash()
+    name = _read_cached_login(token_hash)
+    if name:
+        logger.info(f"Using cached login to Hugging Face Hub as {name}.")
+        return True
+
+    try:
+        user_info = HfApi().whoami()
+    except Exception:  # Catches HTTPError (e.g., 401) if not logged in, or other network issues.
+        logger.error(
+            "Failed to verify Hugging Face Hub login status. "
+            "Please ensure you are logged in using 'huggingface-cli login'. "
+            "The script needs to push data to the Hub."
+        )
+        logger.error("Exiting due to authentication issue. Please run 'huggingface-cli login'.")
+        return False
+
+    logger.info(f"Successfully logged in to Hugging Face Hub as {user_info['name']}.")
+    _write_cached_login(token_hash, user_info['name'])
+    return True